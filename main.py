@@ -5,12 +5,21 @@
 
 import discord
 from discord.ext import commands, tasks
-import json
+from discord.ext.commands import Paginator
+import orjson
 import os
 from dotenv import load_dotenv
 import random
+import types
 import asyncio
-from typing import List
+import functools
+import itertools
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+try:
+    import uvloop  # not available on Windows
+except ImportError:
+    uvloop = None
 
 # -----------------------------
 # Paths & constants
@@ -19,8 +28,13 @@ DATA_DIR = "data"
 CONFIG_PATH = os.path.join(DATA_DIR, "config.json")
 TEMPLATES_PATH = os.path.join(DATA_DIR, "templates.json")
 PROGRESS_PATH = os.path.join(DATA_DIR, "progress.json")
+EXCLUDES_PATH = os.path.join(DATA_DIR, "excludes.json")
+
+# How long stop/reset wait for a send that is already in flight to return
+STOP_TIMEOUT_SECONDS = 30
 
-DEFAULT_CONFIG = {
+# Read-only so nothing can mutate the defaults; take copies via fresh_default()
+DEFAULT_CONFIG = types.MappingProxyType({
     "guild_id": None,
     "target_role_id": None,
     "dm_delay_seconds": 5,
@@ -28,42 +42,82 @@ DEFAULT_CONFIG = {
     "batch_delay_seconds": 60,
     "is_running": False,
     "progress_channel_id": None
-    ,"excluded_user_ids": []
     ,"progress_every": 25
     ,"jitter_seconds": 2
-}
+})
 
-DEFAULT_PROGRESS = {
+DEFAULT_PROGRESS = types.MappingProxyType({
     "member_index": 0,
     "total_sent": 0
     ,"last_progress_sent": 0
-}
+})
 
 # -----------------------------
 # Helpers for JSON persistence
 # -----------------------------
 
+def fresh_default(defaults) -> dict:
+    # the defaults are flat, so a shallow copy gives a mutable, unshared dict
+    return dict(defaults)
+
+
 def ensure_data_files():
     os.makedirs(DATA_DIR, exist_ok=True)
 
-    if not os.path.exists(CONFIG_PATH):
-        save_json(CONFIG_PATH, DEFAULT_CONFIG)
-
-    if not os.path.exists(TEMPLATES_PATH):
-        save_json(TEMPLATES_PATH, {"templates": []})
+    # one directory listing instead of a stat per file
+    with os.scandir(DATA_DIR) as it:
+        existing = {entry.name for entry in it}
 
-    if not os.path.exists(PROGRESS_PATH):
-        save_json(PROGRESS_PATH, DEFAULT_PROGRESS)
+    defaults = (
+        (CONFIG_PATH, fresh_default(DEFAULT_CONFIG), False),
+        (TEMPLATES_PATH, {"templates": []}, False),
+        (PROGRESS_PATH, fresh_default(DEFAULT_PROGRESS), True),
+    )
+    for path, data, compact in defaults:
+        if os.path.basename(path) not in existing:
+            save_json(path, data, compact=compact)
 
 
 def load_json(path: str):
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
+
+
+def _encode(data, compact: bool = False) -> bytes:
+    # compact is for machine-only files like progress.json
+    if compact:
+        return orjson.dumps(data)
+    return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+
+
+def save_json(path: str, data, compact: bool = False):
+    _write_bytes(path, _encode(data, compact))
 
 
-def save_json(path: str, data):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4)
+def _write_bytes(path: str, payload: bytes):
+    # write a sibling temp file and swap it in, so a crash never leaves half a file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+# one lock per file so overlapping commands can't interleave writes
+_file_locks = {}
+
+
+def _file_lock(path: str) -> asyncio.Lock:
+    lock = _file_locks.get(path)
+    if lock is None:
+        lock = _file_locks[path] = asyncio.Lock()
+    return lock
+
+
+async def save_json_async(path: str, data, compact: bool = False):
+    # encode on the loop so the snapshot is consistent, write in a worker thread
+    payload = _encode(data, compact)
+    async with _file_lock(path):
+        await asyncio.to_thread(_write_bytes, path, payload)
 
 
 # -----------------------------
@@ -72,6 +126,7 @@ def save_json(path: str, data):
 intents = discord.Intents.default()
 intents.members = True
 intents.guilds = True
+# required: prefix commands can't be parsed in guild channels without it
 intents.message_content = True
 
 bot = commands.Bot(command_prefix="!", intents=intents)
@@ -79,19 +134,52 @@ bot = commands.Bot(command_prefix="!", intents=intents)
 # In-memory state (mirrors JSON)
 config = {}
 progress = {}
+templates: List[str] = []
+# User IDs never to DM; persisted on their own in excludes.json
+excluded_ids: Set[int] = set()
+
+# Used to stop a running DM loop safely; created on first use (get_stop_event)
+# so on Python 3.9 it binds to the loop bot.run starts, not the import-time one
+_stop_event: Optional[asyncio.Event] = None
+
+# The running dm_scheduler task, if any
+_scheduler_task: Optional[asyncio.Task] = None
+
+# At most one progress post in flight; ticks arriving meanwhile collapse into one
+_progress_send_lock: Optional[asyncio.Lock] = None
+_progress_pending = False
+_progress_posts = set()
 
-# Used to stop a running DM loop safely
-stop_event = asyncio.Event()
+# Set when progress changed in memory but hasn't been written yet
+_progress_dirty = False
+
+# Non-bot member IDs holding the target role, kept current by member events.
+# A dict rather than a set so iteration order (and member_index) stays stable.
+_role_member_ids: Dict[int, None] = {}
+_role_member_ids_role_id: Optional[int] = None
+
+# Rendered command output, reused until the underlying data changes
+_commands_embed: Optional[discord.Embed] = None
+_templates_listing: Optional[str] = None
+
+
+def get_stop_event() -> asyncio.Event:
+    global _stop_event
+    if _stop_event is None:
+        _stop_event = asyncio.Event()
+    return _stop_event
 
 
 # -----------------------------
 # Utility checks
 # -----------------------------
 
-def admin_only():
-    async def predicate(ctx):
-        return ctx.author.guild_permissions.administrator
-    return commands.check(predicate)
+def _is_admin(ctx) -> bool:
+    return ctx.author.guild_permissions.administrator
+
+
+# one shared check instance for every admin command
+admin_only = commands.check(_is_admin)
 
 
 def get_guild():
@@ -100,334 +188,541 @@ def get_guild():
     return bot.get_guild(config["guild_id"])
 
 
+def get_guild_and_role():
+    # (guild, target role); either may be None when unset or not cached
+    guild = get_guild()
+    role_id = config.get("target_role_id")
+    role = guild.get_role(role_id) if guild and role_id else None
+    return guild, role
+
+
+def role_member_ids(role) -> Dict[int, None]:
+    # built from the member cache once per target role, then updated by events
+    global _role_member_ids, _role_member_ids_role_id
+    if _role_member_ids_role_id != role.id:
+        _role_member_ids = dict.fromkeys(m.id for m in role.members if not m.bot)
+        _role_member_ids_role_id = role.id
+    return _role_member_ids
+
+
+def target_member_ids(role, start: int = 0) -> Tuple[int, ...]:
+    # snapshot of the IDs a scheduler run still has to walk, minus excluded users;
+    # the first `start` (already handled) IDs are skipped rather than stored
+    ids = (mid for mid in role_member_ids(role) if mid not in excluded_ids)
+    return tuple(itertools.islice(ids, start, None))
+
+
+def count_role_members(role) -> int:
+    ids = role_member_ids(role)
+    return len(ids) - sum(1 for uid in excluded_ids if uid in ids)
+
+
+def invalidate_member_ids():
+    global _role_member_ids, _role_member_ids_role_id
+    _role_member_ids = {}
+    _role_member_ids_role_id = None
+
+
 # -----------------------------
-# DM sending logic
+# Progress persistence
 # -----------------------------
-async def dm_scheduler():
-    global progress, config
 
-    guild = get_guild()
-    if guild is None:
+def mark_progress_dirty():
+    global _progress_dirty
+    _progress_dirty = True
+
+
+async def save_excludes():
+    # only the ID list is rewritten; config.json is left alone
+    await save_json_async(EXCLUDES_PATH, sorted(excluded_ids), compact=True)
+
+
+def load_excludes() -> Set[int]:
+    if os.path.exists(EXCLUDES_PATH):
+        return set(load_json(EXCLUDES_PATH))
+
+    # one-time move of the list that used to live in config.json
+    ids = set(config.pop("excluded_user_ids", []))
+    save_json(EXCLUDES_PATH, sorted(ids), compact=True)
+    save_json(CONFIG_PATH, config)
+    return ids
+
+
+async def flush_progress_now(force: bool = False):
+    # force is for command handlers that need the file current right away
+    global _progress_dirty
+    if not (_progress_dirty or force):
         return
+    _progress_dirty = False
+    await save_json_async(PROGRESS_PATH, progress, compact=True)
 
-    role_id = config.get("target_role_id")
-    if not role_id:
+
+@tasks.loop(seconds=10)
+async def flush_progress():
+    await flush_progress_now()
+
+
+# -----------------------------
+# DM sending logic
+# -----------------------------
+class RunSettings(NamedTuple):
+    dm_delay: float
+    batch_size: int
+    batch_delay: float
+    progress_every: int
+    jitter: float
+
+
+def snapshot_run_settings() -> RunSettings:
+    # read once per batch so the hot loop works on locals
+    return RunSettings(
+        dm_delay=config.get("dm_delay_seconds", 5),
+        batch_size=config.get("batch_size", 25),
+        batch_delay=config.get("batch_delay_seconds", 60),
+        progress_every=config.get("progress_every", 25),
+        jitter=config.get("jitter_seconds", 2),
+    )
+
+
+async def interruptible_sleep(seconds: float) -> bool:
+    # sleep that wakes early on stopdm; returns True if a stop was requested
+    try:
+        await asyncio.wait_for(get_stop_event().wait(), timeout=seconds)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+def retry_after_seconds(exc: discord.HTTPException) -> Optional[float]:
+    # discord.py already waits out 429s; this reads the hint on anything it re-raises
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+async def resolve_progress_channel():
+    chan_id = config.get("progress_channel_id")
+    if not chan_id:
+        return None
+    ch = bot.get_channel(chan_id)
+    if ch is None:
+        try:
+            ch = await bot.fetch_channel(int(chan_id))
+        except Exception:
+            ch = None
+    return ch
+
+
+async def post_progress(channel, guild, role):
+    global _progress_send_lock, _progress_pending
+    if _progress_send_lock is None:
+        _progress_send_lock = asyncio.Lock()
+    if _progress_send_lock.locked():
+        # the in-flight post will go again with fresh numbers
+        _progress_pending = True
         return
 
-    role = guild.get_role(role_id)
+    async with _progress_send_lock:
+        while True:
+            _progress_pending = False
+            # avoid sending duplicate progress for the same total_sent
+            total = progress.get("total_sent", 0)
+            if total != progress.get("last_progress_sent", 0):
+                await channel.send(embed=build_progress_embed(guild, role))
+                # record what the embed showed, not what the loop reached meanwhile
+                progress["last_progress_sent"] = total
+                mark_progress_dirty()
+            if not _progress_pending:
+                break
+
+
+def _on_progress_post_done(task):
+    _progress_posts.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print("Failed to send automatic progress update:", task.exception())
+
+
+def schedule_progress_post(channel, guild, role):
+    # runs beside the DM loop so a slow channel send doesn't hold it up
+    task = asyncio.create_task(post_progress(channel, guild, role))
+    _progress_posts.add(task)
+    task.add_done_callback(_on_progress_post_done)
+
+
+async def dm_scheduler():
+    global progress, config
+
+    guild, role = get_guild_and_role()
     if role is None:
         return
 
-    templates_data = load_json(TEMPLATES_PATH)
-    templates: List[str] = templates_data.get("templates", [])
     if not templates:
         return
 
-    members = [
-        m for m in role.members
-        if not m.bot and m.id not in config.get("excluded_user_ids", [])
-    ]
+    # shuffled once per run so every template gets an even share
+    shuffled = list(templates)
+    random.shuffle(shuffled)
+    template_cycle = itertools.cycle(shuffled)
+
+    start_index = progress.get("member_index", 0)
+    member_ids = target_member_ids(role, start=start_index)
+    # member_index counts against this run's list, so report totals from it too
+    progress["total_members"] = start_index + len(member_ids)
+    mark_progress_dirty()
+
+    # resolved once per run rather than on every progress tick
+    progress_channel = await resolve_progress_channel()
 
-    member_index = progress.get("member_index", 0)
     sent_in_batch = 0
+    sent_since_progress = 0
+    dm_delay, batch_size, batch_delay, progress_every, jitter_seconds = snapshot_run_settings()
 
-    while member_index < len(members):
-        if stop_event.is_set():
+    for member_index, member_id in enumerate(member_ids, start=start_index):
+        if get_stop_event().is_set():
             break
 
-        member = members[member_index]
-        message = random.choice(templates)
+        # resolve lazily so the run doesn't pin Member objects for hours
+        member = guild.get_member(member_id)
+        if member is None:
+            # left the guild since the snapshot was taken
+            progress["member_index"] = member_index + 1
+            mark_progress_dirty()
+            continue
+
+        message = next(template_cycle)
 
         # attempt to deliver message (DM or channel) with retry/backoff and jitter
         send_success = False
         attempt = 0
         max_attempts = 3
-        delivery_mode = config.get("delivery_mode", "dm")
         while attempt < max_attempts and not send_success:
             try:
                 await member.send(message)
                 progress["total_sent"] += 1
+                sent_since_progress += 1
                 send_success = True
             except discord.Forbidden:
                 # can't DM / cannot send in channel
                 send_success = True
-            except discord.HTTPException:
+            except discord.HTTPException as e:
                 attempt += 1
-                backoff = (2 ** attempt)
-                jitter = random.uniform(0, config.get("jitter_seconds", 2))
-                await asyncio.sleep(backoff + jitter)
+                # honor the server's hint when given, else back off exponentially
+                backoff = retry_after_seconds(e)
+                if backoff is None:
+                    backoff = 2 ** attempt
+                jitter = random.uniform(0, jitter_seconds)
+                if await interruptible_sleep(backoff + jitter):
+                    break
                 if attempt >= max_attempts:
                     send_success = True
 
-        member_index += 1
-        progress["member_index"] = member_index
-        save_json(PROGRESS_PATH, progress)
+        if not send_success:
+            # stopped mid-backoff; leave this member for the next run
+            break
+
+        progress["member_index"] = member_index + 1
+        mark_progress_dirty()
 
         sent_in_batch += 1
-        # check automatic progress interval
-        progress_every = config.get("progress_every", 25)
-        if progress_every > 0 and progress.get("total_sent", 0) % progress_every == 0:
+        # check automatic progress interval (counts delivered DMs only)
+        if progress_every > 0 and sent_since_progress >= progress_every:
+            sent_since_progress = 0
             # send automatic progress update
-            try:
-                chan_id = config.get("progress_channel_id")
-                if chan_id:
-                    ch = bot.get_channel(chan_id)
-                    if ch is None:
-                        try:
-                            ch = await bot.fetch_channel(int(chan_id))
-                        except Exception:
-                            ch = None
-
-                    if ch:
-                        # avoid sending duplicate progress for the same total_sent
-                        last_sent = progress.get("last_progress_sent", 0)
-                        if progress.get("total_sent", 0) != last_sent:
-                            emb = build_progress_embed(guild, role)
-                            await ch.send(embed=emb)
-                            progress["last_progress_sent"] = progress.get("total_sent", 0)
-                            save_json(PROGRESS_PATH, progress)
-            except Exception as e:
-                print("Failed to send automatic progress update:", e)
+            if progress_channel:
+                schedule_progress_post(progress_channel, guild, role)
 
         # Per-message delay
-        await asyncio.sleep(config.get("dm_delay_seconds", 5))
+        if await interruptible_sleep(dm_delay):
+            break
 
         # Batch handling
-        if sent_in_batch >= config.get("batch_size", 25):
+        if sent_in_batch >= batch_size:
             sent_in_batch = 0
+            await flush_progress_now()
             # batch pause
-            await asyncio.sleep(config.get("batch_delay_seconds", 60))
+            if await interruptible_sleep(batch_delay):
+                break
+            # pick up setdelay/setbatch changes made during the run
+            dm_delay, batch_size, batch_delay, progress_every, jitter_seconds = snapshot_run_settings()
 
     config["is_running"] = False
-    save_json(CONFIG_PATH, config)
+    await save_json_async(CONFIG_PATH, config)
+    await flush_progress_now()
     # send final progress update when finished
     try:
         chan_id = config.get("progress_channel_id")
         if chan_id:
-            ch = bot.get_channel(chan_id)
-            if ch is None:
-                try:
-                    ch = await bot.fetch_channel(int(chan_id))
-                except Exception:
-                    ch = None
-
-            if ch:
-                # send final progress only if it wasn't already sent for this total_sent
-                last_sent = progress.get("last_progress_sent", 0)
-                if progress.get("total_sent", 0) != last_sent:
-                    emb = build_progress_embed(guild, role)
-                    await ch.send(embed=emb)
-                    progress["last_progress_sent"] = progress.get("total_sent", 0)
-                    save_json(PROGRESS_PATH, progress)
+            if progress_channel:
+                # folds into an in-flight auto post if there is one
+                await post_progress(progress_channel, guild, role)
+                await flush_progress_now()
             else:
                 print(f"Final progress: progress channel {chan_id} not found/cached")
     except Exception as e:
         print("Failed to send final progress update:", e)
 
 
+async def run_dm_scheduler():
+    # supervised entry point: progress stays durable if shutdown cancels the task
+    try:
+        await dm_scheduler()
+    except asyncio.CancelledError:
+        await flush_progress_now(force=True)
+        raise
+    except Exception as e:
+        print("DM scheduler crashed:", e)
+        config["is_running"] = False
+        await save_json_async(CONFIG_PATH, config)
+        await flush_progress_now(force=True)
+
+
+async def stop_dm_scheduler() -> bool:
+    # signal the loop and let it wind down on its own (every sleep wakes on the
+    # event); it is never cancelled, so a send or write is never cut in half.
+    # Returns False if it is still finishing an in-flight send after the timeout.
+    get_stop_event().set()
+    task = _scheduler_task
+    if task is None or task.done():
+        return True
+    done, _ = await asyncio.wait({task}, timeout=STOP_TIMEOUT_SECONDS)
+    return task in done
+
+
 # -----------------------------
 # Events
 # -----------------------------
 @bot.event
 async def on_ready():
     print(f"Logged in as {bot.user}")
+    global _commands_embed
+    _commands_embed = build_commands_embed()
+    if not flush_progress.is_running():
+        flush_progress.start()
+
+
+@bot.event
+async def on_member_update(before, after):
+    role_id = _role_member_ids_role_id
+    if role_id is None or after.bot or after.guild.id != config.get("guild_id"):
+        return
+    if after.get_role(role_id) is not None:
+        _role_member_ids[after.id] = None
+    else:
+        _role_member_ids.pop(after.id, None)
+
+
+@bot.event
+async def on_member_remove(member):
+    if member.guild.id == config.get("guild_id"):
+        _role_member_ids.pop(member.id, None)
+
+
+@bot.event
+async def on_guild_role_delete(role):
+    if role.id == _role_member_ids_role_id:
+        invalidate_member_ids()
 
 
 # -----------------------------
 # Commands (Admin only)
 # -----------------------------
 @bot.command(help="Lock the bot to the current guild (server).")
-@admin_only()
+@admin_only
 async def setguild(ctx):
     config["guild_id"] = ctx.guild.id
-    save_json(CONFIG_PATH, config)
+    await save_json_async(CONFIG_PATH, config)
     await ctx.send("Guild locked for this bot.")
 
 
 @bot.command(help="Set the target role to DM members of.")
-@admin_only()
+@admin_only
 async def setrole(ctx, role: discord.Role):
     config["target_role_id"] = role.id
+    if not ctx.guild.chunked:
+        await ctx.guild.chunk()
+    invalidate_member_ids()
+    role_member_ids(role)
     progress["member_index"] = 0
-    save_json(CONFIG_PATH, config)
-    save_json(PROGRESS_PATH, progress)
+    progress.pop("total_members", None)
+    await save_json_async(CONFIG_PATH, config)
+    await flush_progress_now(force=True)
     await ctx.send(f"Target role set to {role.name}")
 
 
 @bot.command(help="Set delay (seconds) between DMs.")
-@admin_only()
+@admin_only
 async def setdelay(ctx, seconds: int):
     config["dm_delay_seconds"] = max(1, seconds)
-    save_json(CONFIG_PATH, config)
+    await save_json_async(CONFIG_PATH, config)
     await ctx.send(f"DM delay set to {seconds} seconds")
 
 
 @bot.command(help="Set batch size and optional batch delay in seconds. Usage: !setbatch <size> [delay]")
-@admin_only()
+@admin_only
 async def setbatch(ctx, size: int, delay: int = None):
     config["batch_size"] = max(1, size)
     # if delay not provided, keep existing or fall back to 60
     if delay is None:
         delay = config.get("batch_delay_seconds", 60)
     config["batch_delay_seconds"] = max(0, delay)
-    save_json(CONFIG_PATH, config)
+    await save_json_async(CONFIG_PATH, config)
     await ctx.send(f"Batch settings updated: {config['batch_size']} msgs / {config['batch_delay_seconds']}s")
 
 
 @bot.command(help="Add a DM message template.")
-@admin_only()
+@admin_only
 async def addtemplate(ctx, *, text: str):
-    data = load_json(TEMPLATES_PATH)
-    data.setdefault("templates", []).append(text)
-    save_json(TEMPLATES_PATH, data)
+    global _templates_listing
+    if text in templates:
+        await ctx.send("Template already exists")
+        return
+
+    templates.append(text)
+    _templates_listing = None
+    await save_json_async(TEMPLATES_PATH, {"templates": templates})
     await ctx.send("Template added")
 
 
 @bot.command(name="listtemplates", aliases=["listtemplate", "templates"], help="List saved DM templates.")
-@admin_only()
+@admin_only
 async def listtemplates(ctx):
-    data = load_json(TEMPLATES_PATH)
-    templates = data.get("templates", [])
+    global _templates_listing
     if not templates:
         await ctx.send("No templates saved.")
         return
 
-    lines = [f"{i+1}. {t}" for i, t in enumerate(templates)]
-    await ctx.send("\n".join(lines))
+    if _templates_listing is None:
+        _templates_listing = "\n".join(f"{i+1}. {t}" for i, t in enumerate(templates))
+    await ctx.send(_templates_listing)
 
 
 @bot.command(help="Delete a saved template by its 1-based index. Usage: !deletetemplate <index>")
-@admin_only()
+@admin_only
 async def deletetemplate(ctx, index: int):
-    data = load_json(TEMPLATES_PATH)
-    templates = data.get("templates", [])
+    global _templates_listing
     if index < 1 or index > len(templates):
         await ctx.send("Invalid template index")
         return
 
     removed = templates.pop(index-1)
-    data["templates"] = templates
-    save_json(TEMPLATES_PATH, data)
+    _templates_listing = None
+    await save_json_async(TEMPLATES_PATH, {"templates": templates})
     await ctx.send(f"Removed template: {removed}")
 
 
 @bot.command(help="Start sending DMs to members of the configured role.")
-@admin_only()
+@admin_only
 async def startdm(ctx):
-    if config.get("is_running"):
+    global _scheduler_task
+    still_finishing = _scheduler_task is not None and not _scheduler_task.done()
+    if config.get("is_running") or still_finishing:
         await ctx.send("DM process already running")
         return
 
-    stop_event.clear()
+    get_stop_event().clear()
     config["is_running"] = True
-    save_json(CONFIG_PATH, config)
+    await save_json_async(CONFIG_PATH, config)
 
-    bot.loop.create_task(dm_scheduler())
+    _scheduler_task = asyncio.create_task(run_dm_scheduler())
     await ctx.send("DM sending started")
 
 
 @bot.command(help="Add a user ID to the exclude list so they will not be DMed.")
-@admin_only()
+@admin_only
 async def addexclude(ctx, user_id: int):
-    ex = config.setdefault("excluded_user_ids", [])
-    if user_id in ex:
+    if user_id in excluded_ids:
         await ctx.send("User already excluded.")
         return
-    ex.append(user_id)
-    save_json(CONFIG_PATH, config)
+    excluded_ids.add(user_id)
+    await save_excludes()
     await ctx.send(f"Excluded user ID: {user_id}")
 
 
 @bot.command(help="Set how many DMs between automatic progress updates. Usage: !setprogressinterval <count>")
-@admin_only()
+@admin_only
 async def setprogressinterval(ctx, count: int):
     if count < 1:
         await ctx.send("Interval must be at least 1")
         return
     config["progress_every"] = count
-    save_json(CONFIG_PATH, config)
+    await save_json_async(CONFIG_PATH, config)
     await ctx.send(f"Automatic progress interval set to every {count} DMs")
 
 
 @bot.command(help="Set delivery mode: 'dm' to DM users or 'channel' to post messages in a channel.")
-@admin_only()
+@admin_only
 async def setdeliverymode(ctx, mode: str):
     if mode not in ("dm", "channel"):
         await ctx.send("Mode must be 'dm' or 'channel'")
         return
     config["delivery_mode"] = mode
-    save_json(CONFIG_PATH, config)
+    await save_json_async(CONFIG_PATH, config)
     await ctx.send(f"Delivery mode set to {mode}")
 
 
 @bot.command(help="Set the channel to deliver messages when delivery mode is 'channel'. Usage: !setdeliverychannel #channel")
-@admin_only()
+@admin_only
 async def setdeliverychannel(ctx, channel: discord.TextChannel):
     config["delivery_channel_id"] = channel.id
-    save_json(CONFIG_PATH, config)
+    await save_json_async(CONFIG_PATH, config)
     await ctx.send(f"Delivery channel set to {channel.mention}")
 
 
 @bot.command(help="Set jitter seconds used in backoff to reduce burstiness. Usage: !setjitter <seconds>")
-@admin_only()
+@admin_only
 async def setjitter(ctx, seconds: int):
     config["jitter_seconds"] = max(0, seconds)
-    save_json(CONFIG_PATH, config)
+    await save_json_async(CONFIG_PATH, config)
     await ctx.send(f"Jitter seconds set to {config['jitter_seconds']}")
 
 
 @bot.command(help="Remove a user ID from the exclude list.")
-@admin_only()
+@admin_only
 async def removeexclude(ctx, user_id: int):
-    ex = config.setdefault("excluded_user_ids", [])
-    if user_id not in ex:
+    if user_id not in excluded_ids:
         await ctx.send("User ID not in exclude list.")
         return
-    ex.remove(user_id)
-    save_json(CONFIG_PATH, config)
+    excluded_ids.discard(user_id)
+    await save_excludes()
     await ctx.send(f"Removed exclude: {user_id}")
 
 
 @bot.command(help="List excluded user IDs.")
-@admin_only()
+@admin_only
 async def listexcludes(ctx):
-    ex = config.get("excluded_user_ids", [])
+    ex = sorted(excluded_ids)
     if not ex:
         await ctx.send("No excluded users.")
         return
 
     guild = get_guild()
-    lines = []
+    # split across messages so long lists stay under Discord's 2000 char limit
+    paginator = Paginator(prefix=None, suffix=None)
     for uid in ex:
-        member = None
-        if guild:
-            member = guild.get_member(uid)
+        # Member string is like Name#discriminator
+        who = (guild.get_member(uid) if guild else None) or bot.get_user(uid) or "(not found)"
+        paginator.add_line(f"{uid} - {who}")
 
-        if member:
-            # Member string is like Name#discriminator
-            lines.append(f"{uid} - {member}")
-            continue
-
-        user = bot.get_user(uid)
-        if user:
-            lines.append(f"{uid} - {user}")
-            continue
-
-        lines.append(f"{uid} - (not found)")
-
-    await ctx.send("\n".join(lines))
+    for page in paginator.pages:
+        await ctx.send(page)
 
 
 @bot.command(help="Set channel where progress updates will be posted. Usage: !setprogresschannel #channel")
-@admin_only()
+@admin_only
 async def setprogresschannel(ctx, channel: discord.TextChannel):
     config["progress_channel_id"] = channel.id
-    save_json(CONFIG_PATH, config)
+    await save_json_async(CONFIG_PATH, config)
     await ctx.send(f"Progress channel set to {channel.mention}")
 
 
 @bot.command(help="Send current progress to a channel or the configured progress channel. Usage: !sendprogress [#channel]")
-@admin_only()
+@admin_only
 async def sendprogress(ctx, channel: discord.TextChannel = None):
     # choose provided channel or saved one
     target = channel
@@ -440,75 +735,47 @@ async def sendprogress(ctx, channel: discord.TextChannel = None):
         await ctx.send("No progress channel provided or configured.")
         return
 
-    guild = get_guild()
-    role = guild.get_role(config.get("target_role_id")) if guild else None
-
-    # compute member counts and estimated remaining time
-    total_members = 0
-    remaining = 0
-    est_seconds = 0
-    if guild and role:
-        members = [m for m in role.members if not m.bot]
-        total_members = len(members)
-        member_index = progress.get("member_index", 0)
-        remaining = max(0, total_members - member_index)
-
-        dm_delay = config.get("dm_delay_seconds", 5)
-        batch_size = config.get("batch_size", 25)
-        batch_delay = config.get("batch_delay_seconds", 60)
-
-        if remaining > 0:
-            full_batches = remaining // batch_size
-            est_seconds = remaining * dm_delay + full_batches * batch_delay
-
-    def _fmt_seconds(sec: int) -> str:
-        sec = int(sec)
-        h = sec // 3600
-        m = (sec % 3600) // 60
-        s = sec % 60
-        if h:
-            return f"{h}h {m}m {s}s"
-        if m:
-            return f"{m}m {s}s"
-        return f"{s}s"
-
-    est_str = _fmt_seconds(est_seconds) if remaining > 0 else "0s"
+    guild, role = get_guild_and_role()
 
     embed = build_progress_embed(guild, role)
     await target.send(embed=embed)
 
 
-def build_progress_message(guild, role):
-    # compute member counts and estimated remaining time
+@functools.lru_cache(maxsize=256)
+def _fmt_seconds(sec: int) -> str:
+    h, rem = divmod(sec, 3600)
+    m, s = divmod(rem, 60)
+    if h:
+        return f"{h}h {m}m {s}s"
+    if m:
+        return f"{m}m {s}s"
+    return f"{s}s"
+
+
+def compute_eta(remaining: int, cfg) -> int:
+    # per-DM delay for every remaining member plus a pause per full batch
+    if remaining <= 0:
+        return 0
+    batches = remaining // cfg.get("batch_size", 25)
+    return remaining * cfg.get("dm_delay_seconds", 5) + batches * cfg.get("batch_delay_seconds", 60)
+
+
+def progress_stats(guild, role) -> Tuple[int, int, str]:
+    # (total members, remaining, formatted ETA) shared by the progress builders
     total_members = 0
     remaining = 0
-    est_seconds = 0
     if guild and role:
-        members = [m for m in role.members if not m.bot]
-        total_members = len(members)
-        member_index = progress.get("member_index", 0)
-        remaining = max(0, total_members - member_index)
-
-        dm_delay = config.get("dm_delay_seconds", 5)
-        batch_size = config.get("batch_size", 25)
-        batch_delay = config.get("batch_delay_seconds", 60)
-
-        if remaining > 0:
-            full_batches = remaining // batch_size
-            est_seconds = remaining * dm_delay + full_batches * batch_delay
-
-    def _fmt_seconds(sec: int) -> str:
-        sec = int(sec)
-        h = sec // 3600
-        m = (sec % 3600) // 60
-        s = sec % 60
-        if h:
-            return f"{h}h {m}m {s}s"
-        if m:
-            return f"{m}m {s}s"
-        return f"{s}s"
-
-    est_str = _fmt_seconds(est_seconds) if remaining > 0 else "0s"
+        total_members = progress.get("total_members")
+        if total_members is None:
+            total_members = count_role_members(role)
+        remaining = max(0, total_members - progress.get("member_index", 0))
+
+    est_str = _fmt_seconds(int(compute_eta(remaining, config))) if remaining > 0 else "0s"
+    return total_members, remaining, est_str
+
+
+def build_progress_message(guild, role):
+    total_members, remaining, est_str = progress_stats(guild, role)
 
     msg = (
         f"Running: {config.get('is_running')}\n"
@@ -528,35 +795,7 @@ def build_progress_message(guild, role):
 
 def build_progress_embed(guild, role):
     # Build an embed with the same data but nicely formatted
-    total_members = 0
-    remaining = 0
-    est_seconds = 0
-    if guild and role:
-        members = [m for m in role.members if not m.bot]
-        total_members = len(members)
-        member_index = progress.get("member_index", 0)
-        remaining = max(0, total_members - member_index)
-
-        dm_delay = config.get("dm_delay_seconds", 5)
-        batch_size = config.get("batch_size", 25)
-        batch_delay = config.get("batch_delay_seconds", 60)
-
-        if remaining > 0:
-            full_batches = remaining // batch_size
-            est_seconds = remaining * dm_delay + full_batches * batch_delay
-
-    def _fmt_seconds(sec: int) -> str:
-        sec = int(sec)
-        h = sec // 3600
-        m = (sec % 3600) // 60
-        s = sec % 60
-        if h:
-            return f"{h}h {m}m {s}s"
-        if m:
-            return f"{m}m {s}s"
-        return f"{s}s"
-
-    est_str = _fmt_seconds(est_seconds) if remaining > 0 else "0s"
+    total_members, remaining, est_str = progress_stats(guild, role)
 
     emb = discord.Embed(title="DM Progress", color=discord.Color.green())
     # concise single-line fields
@@ -572,35 +811,42 @@ def build_progress_embed(guild, role):
 
 
 @bot.command(help="Stop the DM sending process.")
-@admin_only()
+@admin_only
 async def stopdm(ctx):
-    stop_event.set()
+    stopped = await stop_dm_scheduler()
     config["is_running"] = False
-    save_json(CONFIG_PATH, config)
-    await ctx.send("DM sending stopped")
+    await save_json_async(CONFIG_PATH, config)
+    await flush_progress_now(force=True)
+    if stopped:
+        await ctx.send("DM sending stopped")
+    else:
+        await ctx.send("DM sending will stop once the current send finishes")
 
 
 @bot.command(help="Reset DM progress (member index and total sent). This also stops any running DM process.")
-@admin_only()
+@admin_only
 async def resetprogress(ctx):
     # stop running loop if any
-    stop_event.set()
+    if not await stop_dm_scheduler():
+        # resetting now would race the in-flight send's progress update
+        await ctx.send("DM process is still finishing its current send; try again shortly.")
+        return
     config["is_running"] = False
-    save_json(CONFIG_PATH, config)
+    await save_json_async(CONFIG_PATH, config)
 
     # reset progress counters
     progress["member_index"] = 0
     progress["total_sent"] = 0
-    save_json(PROGRESS_PATH, progress)
+    progress.pop("total_members", None)
+    await flush_progress_now(force=True)
 
     await ctx.send("Progress has been reset.")
 
 
 @bot.command(help="Show current bot configuration and progress.")
-@admin_only()
+@admin_only
 async def status(ctx):
-    guild = get_guild()
-    role = guild.get_role(config.get("target_role_id")) if guild else None
+    guild, role = get_guild_and_role()
 
     msg = (
         f"Running: {config.get('is_running')}\n"
@@ -615,9 +861,17 @@ async def status(ctx):
 
 
 @bot.command(name="commands", aliases=["cmds", "helpcmds"], help="Show available commands in a clean embed.")
-@admin_only()
+@admin_only
 async def commands(ctx):
     """Send a simple embed listing commands and their descriptions."""
+    global _commands_embed
+    if _commands_embed is None:
+        _commands_embed = build_commands_embed()
+    await ctx.send(embed=_commands_embed)
+
+
+def build_commands_embed():
+    # the command set is fixed once the module is loaded, so this is built once
     embed = discord.Embed(title="Bot Commands", color=discord.Color.blurple())
 
     # gather visible commands and their help text
@@ -632,22 +886,32 @@ async def commands(ctx):
         value = cmd.help or "No description"
         embed.add_field(name=name, value=value, inline=False)
 
-    await ctx.send(embed=embed)
+    return embed
 
 
 # -----------------------------
 # Entrypoint
 # -----------------------------
-if __name__ == "__main__":
+def main():
+    global config, progress, templates, excluded_ids
     ensure_data_files()
     config = load_json(CONFIG_PATH)
     progress = load_json(PROGRESS_PATH)
-
-    # Load .env (if present) then read DISCORD_TOKEN
-    load_dotenv()
-    TOKEN = os.getenv("DISCORD_TOKEN")
-    if not TOKEN:
+    excluded_ids = load_excludes()
+    # drop duplicates (keeping order) so no template gets a bigger share
+    templates = list(dict.fromkeys(load_json(TEMPLATES_PATH).get("templates", [])))
+
+    # Load .env (if present) once; real environment variables win
+    load_dotenv(override=False)
+    token = os.environ.get("DISCORD_TOKEN")
+    if not token:
         raise RuntimeError("Set DISCORD_TOKEN environment variable")
 
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    bot.run(token)
 
-    bot.run(TOKEN)
+
+if __name__ == "__main__":
+    main()